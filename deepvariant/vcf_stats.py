@@ -30,31 +30,15 @@ r"""Library to produce variant statistics from a VCF file."""
 
 import collections
 import itertools
-import math
+import multiprocessing
 import numpy as np
 
+from third_party.nucleus.io import vcf
 from third_party.nucleus.util import variant_utils
 from third_party.nucleus.util import variantcall_utils
+from third_party.nucleus.util import vcf_constants
 from deepvariant import vcf_stats_vis
 
-_VARIANT_STATS_COLUMNS = [
-    'reference_name',
-    'position',
-    'reference_bases',
-    'alternate_bases',
-    'variant_type',
-    'is_variant',
-    'is_transition',
-    'is_transversion',
-    'depth',
-    'genotype_quality',
-    'genotype',
-    'vaf',
-    'qual',
-]
-
-VariantStats = collections.namedtuple('VariantStats', _VARIANT_STATS_COLUMNS)
-
 BIALLELIC_SNP = 'Biallelic_SNP'
 BIALLELIC_INSERTION = 'Biallelic_Insertion'
 BIALLELIC_DELETION = 'Biallelic_Deletion'
@@ -65,94 +49,413 @@ MULTIALLELIC_DELETION = 'Multiallelic_Deletion'
 MULTIALLELIC_COMPLEX = 'Multiallelic_Complex'
 REFCALL = 'RefCall'
 
+# Variant types in the order of their integer codes, used to count the types
+# of many variants at once with np.bincount.
+_VARIANT_TYPES = [
+    BIALLELIC_SNP,
+    BIALLELIC_INSERTION,
+    BIALLELIC_DELETION,
+    BIALLELIC_MNP,
+    MULTIALLELIC_SNP,
+    MULTIALLELIC_INSERTION,
+    MULTIALLELIC_DELETION,
+    MULTIALLELIC_COMPLEX,
+    REFCALL,
+]
+_VARIANT_TYPE_CODES = {vtype: code for code, vtype in enumerate(_VARIANT_TYPES)}
+
+# Alternate alleles that variant_utils ignores when classifying a variant.
+_EXCLUDED_ALTS = frozenset([
+    vcf_constants.GVCF_ALT_ALLELE,
+    vcf_constants.SYMBOLIC_ALT_ALLELE,
+    vcf_constants.MISSING_FIELD,
+])
+
+# Stands in for a missing depth or genotype quality in integer columns.
+_MISSING_INT_VALUE = -1
+
+# Codes of the bases A, C, G and T indexed by ASCII value, with 4 for any other
+# character. The codes are chosen so that the transitions, A<->G and C<->T, are
+# exactly the pairs of codes whose XOR is 2.
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+_BASE_CODES[[ord(base) for base in 'ACGT']] = [0, 1, 2, 3]
+
+# Genotype strings of common diploid genotypes, keyed by their sorted alleles.
+_DIPLOID_GENOTYPE_KEYS = {
+    (a, b): str([a, b]) for a in range(-1, 4) for b in range(a, 4)
+}
+
+# Variants are read and turned into columns this many at a time, so that only
+# a bounded number of Variant protos is held in memory at once, see
+# _count_variant_stats_by_chunk.
+_VARIANTS_PER_CHUNK = 100000
+
+
+def _variant_type_from_features(biallelic, snp, insertion, deletion):
+  """Returns the type of a variant call given its allele features."""
+  if biallelic:
+    if snp:
+      return BIALLELIC_SNP
+    elif insertion:
+      return BIALLELIC_INSERTION
+    elif deletion:
+      return BIALLELIC_DELETION
+    else:
+      return BIALLELIC_MNP
+  else:
+    if snp:
+      return MULTIALLELIC_SNP
+    elif insertion:
+      return MULTIALLELIC_INSERTION
+    elif deletion:
+      return MULTIALLELIC_DELETION
+    else:
+      return MULTIALLELIC_COMPLEX
+
+
+def _variant_type_key(biallelic, snp, insertion, deletion):
+  """Packs the allele features of variants into keys of _VARIANT_TYPE_TABLE.
+
+  Args:
+    biallelic: bool or np.ndarray of bools.
+    snp: bool or np.ndarray of bools.
+    insertion: bool or np.ndarray of bools.
+    deletion: bool or np.ndarray of bools.
+
+  Returns:
+    An int, or an np.ndarray of ints, in the range [0, 16).
+  """
+  return biallelic << 3 | snp << 2 | insertion << 1 | deletion
+
+
+# Variant type codes of variant calls indexed by _variant_type_key, so that a
+# type is looked up instead of walking through _variant_type_from_features.
+_VARIANT_TYPE_TABLE = np.array(
+    [
+        _VARIANT_TYPE_CODES[
+            _variant_type_from_features(
+                *(bool(key >> bit & 1) for bit in (3, 2, 1, 0))
+            )
+        ]
+        for key in range(16)
+    ],
+    dtype=np.uint8,
+)
+
 
 def _get_variant_type(variant):
   """Returns the type of variant as a string."""
-  if variant_utils.is_variant_call(variant):
-    biallelic = variant_utils.is_biallelic(variant)
-    snp = variant_utils.is_snp(variant)
-    insertion = variant_utils.variant_is_insertion(variant)
-    deletion = variant_utils.variant_is_deletion(variant)
-
-    if biallelic:
-      if snp:
-        return BIALLELIC_SNP
-      elif insertion:
-        return BIALLELIC_INSERTION
-      elif deletion:
-        return BIALLELIC_DELETION
-      else:
-        return BIALLELIC_MNP
-    else:
-      if snp:
-        return MULTIALLELIC_SNP
-      elif insertion:
-        return MULTIALLELIC_INSERTION
-      elif deletion:
-        return MULTIALLELIC_DELETION
-      else:
-        return MULTIALLELIC_COMPLEX
-  else:
+  if not variant_utils.is_variant_call(variant):
     return REFCALL
+  key = _variant_type_key(*_allele_features(variant))
+  return _VARIANT_TYPES[_VARIANT_TYPE_TABLE[key]]
 
 
-def _tstv(variant, vtype):
-  """Returns a pair of bools indicating Transition, Transversion status."""
-  if vtype == BIALLELIC_SNP:
-    is_transition = variant_utils.is_transition(
-        variant.reference_bases, variant.alternate_bases[0]
-    )
-    is_transversion = not is_transition
-  else:
-    is_transition = is_transversion = False
+def _allele_features(variant):
+  """Returns whether a variant is biallelic, a SNP, an insertion, a deletion.
 
-  return is_transition, is_transversion
+  These are the variant_utils predicates that classify a variant call,
+  computed in a single pass over the alternate alleles.
 
+  Args:
+    variant: Variant.
 
-def _get_vaf(variant, vcf_reader):
-  """Gets the VAF (variant allele frequency)."""
-  vafs = variantcall_utils.get_format(
-      variant_utils.only_call(variant), 'VAF', vcf_reader
-  )
+  Returns:
+    A tuple of four bools: biallelic, snp, insertion and deletion.
+  """
+  ref_length = len(variant.reference_bases)
+  num_alts = 0
+  snp = ref_length == 1
+  insertion = deletion = True
+  for alt in variant.alternate_bases:
+    if alt in _EXCLUDED_ALTS:
+      continue
+    num_alts += 1
+    alt_length = len(alt)
+    snp = snp and alt_length == 1
+    insertion = insertion and ref_length < alt_length
+    deletion = deletion and ref_length > alt_length
+  if not num_alts:
+    return False, False, False, False
+  return num_alts == 1, snp, insertion, deletion
+
+
+def _classify_variants(is_variant, biallelic, snp, insertion, deletion):
+  """Computes the variant types of many variants at once.
+
+  This is _get_variant_type applied to arrays holding the predicates it
+  checks for each variant.
+
+  Args:
+    is_variant: np.ndarray of bools, see variant_utils.is_variant_call.
+    biallelic: np.ndarray of bools, see _allele_features.
+    snp: np.ndarray of bools, see _allele_features.
+    insertion: np.ndarray of bools, see _allele_features.
+    deletion: np.ndarray of bools, see _allele_features.
+
+  Returns:
+    np.ndarray of variant type codes, see _VARIANT_TYPE_CODES.
+  """
+  codes = _VARIANT_TYPE_TABLE[
+      _variant_type_key(
+          biallelic.astype(np.uint8),
+          snp.astype(np.uint8),
+          insertion.astype(np.uint8),
+          deletion.astype(np.uint8),
+      )
+  ]
+  codes[~is_variant] = _VARIANT_TYPE_CODES[REFCALL]
+  return codes
+
+
+def _is_transition(ref_bases, alt_bases):
+  """Checks whether SNPs are transitions.
+
+  Args:
+    ref_bases: np.ndarray of uint8, the ASCII value of each reference base.
+    alt_bases: np.ndarray of uint8, the ASCII value of each alternate base.
+
+  Returns:
+    np.ndarray of bools, True where a SNP is a transition.
+  """
+  return (_BASE_CODES[ref_bases] ^ _BASE_CODES[alt_bases]) == 2
+
+
+def _tstv_columns(variant_type, ref_bases, alt_bases):
+  """Computes the Transition, Transversion status of many variants at once.
+
+  Args:
+    variant_type: np.ndarray of variant type codes, see _VARIANT_TYPE_CODES.
+    ref_bases: np.ndarray of uint8, the ASCII value of the reference base of
+      each biallelic SNP.
+    alt_bases: np.ndarray of uint8, the ASCII value of the alternate base of
+      each biallelic SNP.
+
+  Returns:
+    A pair of np.ndarrays of bools indicating Transition, Transversion status.
+  """
+  biallelic_snp = variant_type == _VARIANT_TYPE_CODES[BIALLELIC_SNP]
+  is_transition = _is_transition(ref_bases, alt_bases)
+  return biallelic_snp & is_transition, biallelic_snp & ~is_transition
+
+
+def _genotype_key(gt):
+  """Returns str(sorted(gt)), the string that variants are grouped by."""
+  if len(gt) == 2:
+    a, b = gt
+    if a > b:
+      a, b = b, a
+    key = _DIPLOID_GENOTYPE_KEYS.get((a, b))
+    if key is not None:
+      return key
+  return str(sorted(gt))
+
+
+def _get_vaf(call, vcf_reader):
+  """Gets the VAF (variant allele frequency) of the variant's only call."""
+  vafs = variantcall_utils.get_format(call, 'VAF', vcf_reader)
   return sum(vafs)
 
 
-def _get_variant_stats(variant, vaf_available=False, vcf_reader=None):
-  """Returns a VariantStats object corresponding to the input variant."""
-  vtype = _get_variant_type(variant)
-  is_transition, is_transversion = _tstv(variant, vtype)
-  vaf = None
-  if vaf_available:
-    vaf = _get_vaf(variant, vcf_reader)
-
-  return VariantStats(
-      reference_name=variant.reference_name,
-      position=(variant.start + 1),
-      reference_bases=variant.reference_bases,
-      alternate_bases=list(variant.alternate_bases),
-      variant_type=vtype,
-      is_transition=is_transition,
-      is_transversion=is_transversion,
-      is_variant=variant_utils.is_variant_call(variant),
-      depth=variantcall_utils.get_format(
-          variant_utils.only_call(variant), 'DP'
-      ),
-      genotype_quality=variantcall_utils.get_gq(
-          variant_utils.only_call(variant)
-      ),
-      genotype=str(
-          sorted(variantcall_utils.get_gt(variant_utils.only_call(variant)))
-      ),
-      vaf=vaf,
-      qual=variant.quality,
+def _int_or_missing(value):
+  """Returns value, or _MISSING_INT_VALUE if the FORMAT field was not set."""
+  if isinstance(value, list):
+    return _MISSING_INT_VALUE
+  return value
+
+
+def _chunks(iterable, chunk_size):
+  """Yields lists of up to chunk_size consecutive elements of iterable."""
+  iterator = iter(iterable)
+  chunk = list(itertools.islice(iterator, chunk_size))
+  while chunk:
+    yield chunk
+    chunk = list(itertools.islice(iterator, chunk_size))
+
+
+class _VcfHeaderFields(object):
+  """Gives access to the FORMAT fields defined in a VCF header.
+
+  variantcall_utils.get_format only uses the field_access_cache of the VCF
+  object it is given. Worker processes use this in place of the VcfReader,
+  which cannot be sent to them.
+  """
+
+  def __init__(self, header):
+    self.field_access_cache = vcf.VcfHeaderCache(header)
+
+
+def _count_variant_stats_for_chunk(
+    variants, vaf_available, vcf_reader, number_of_vaf_bins
+):
+  """Counts the stats of a chunk of variants, see _count_variant_stats."""
+  return _count_variant_stats(
+      _variant_stats_columns_for_chunk(variants, vaf_available, vcf_reader),
+      number_of_vaf_bins,
   )
 
 
-def _single_variant_stats(variants, vaf_available=False, vcf_reader=None):
-  return [
-      _get_variant_stats(v, vaf_available=vaf_available, vcf_reader=vcf_reader)
-      for v in variants
-  ]
+def _count_variant_stats_for_chunk_in_worker(
+    variants, vaf_available, vcf_header, number_of_vaf_bins
+):
+  """Runs _count_variant_stats_for_chunk in a worker process."""
+  vcf_fields = _VcfHeaderFields(vcf_header) if vcf_header else None
+  return _count_variant_stats_for_chunk(
+      variants, vaf_available, vcf_fields, number_of_vaf_bins
+  )
+
+
+def _count_variant_stats_in_parallel(
+    chunks, vaf_available, vcf_reader, number_of_vaf_bins, cpus
+):
+  """Counts the stats of each chunk of variants in a pool of processes.
+
+  Only the counts of each chunk are sent back from the workers, not the stats
+  of each variant.
+
+  Args:
+    chunks: iterable(list(Variant)).
+    vaf_available: bool. Whether VAF is defined in the VCF FORMAT fields.
+    vcf_reader: VcfReader.
+    number_of_vaf_bins: integer, number of bins in allele frequency histogram.
+    cpus: int. Number of worker processes.
+
+  Yields:
+    The _VariantStatsCounts of each chunk, in the order of chunks.
+  """
+  vcf_header = vcf_reader.header if vaf_available else None
+  # At most one chunk more than there are workers is handed out ahead of time,
+  # so that the variants being read do not pile up in memory waiting for a
+  # worker.
+  pending = collections.deque()
+  with multiprocessing.Pool(cpus) as pool:
+    for chunk in chunks:
+      if len(pending) >= cpus + 1:
+        yield pending.popleft().get()
+      pending.append(
+          pool.apply_async(
+              _count_variant_stats_for_chunk_in_worker,
+              (chunk, vaf_available, vcf_header, number_of_vaf_bins),
+          )
+      )
+    while pending:
+      yield pending.popleft().get()
+
+
+def _count_variant_stats_by_chunk(
+    variants,
+    number_of_vaf_bins,
+    vaf_available=False,
+    vcf_reader=None,
+    cpus=0,
+):
+  """Counts the stats of variants, one chunk of variants at a time.
+
+  Variants are consumed in chunks of _VARIANTS_PER_CHUNK, so neither the input
+  nor the stats of all variants are ever held in memory as a whole. If there
+  is more than one chunk and cpus is greater than 1, the variants are instead
+  split into cpus + 1 times smaller chunks that are counted in parallel, so
+  that about _VARIANTS_PER_CHUNK variants are in flight at once regardless of
+  the number of workers. The first _VARIANTS_PER_CHUNK variants are read up
+  front to make that choice and stay referenced until all variants have been
+  read, so up to about twice _VARIANTS_PER_CHUNK variants are held at once.
+
+  Args:
+    variants: iterable(Variant).
+    number_of_vaf_bins: integer, number of bins in allele frequency histogram.
+    vaf_available: bool. Whether VAF is defined in the VCF FORMAT fields.
+    vcf_reader: VcfReader.
+    cpus: int. Number of worker processes to use. Use 0 or 1 to process all
+      variants in this process.
+
+  Yields:
+    The _VariantStatsCounts of each chunk, in order.
+  """
+  variants = iter(variants)
+  first_chunk = list(itertools.islice(variants, _VARIANTS_PER_CHUNK))
+  if not first_chunk:
+    return
+  parallel = cpus > 1 and len(first_chunk) == _VARIANTS_PER_CHUNK
+  chunk_size = (
+      max(1, _VARIANTS_PER_CHUNK // (cpus + 1))
+      if parallel
+      else _VARIANTS_PER_CHUNK
+  )
+  chunks = _chunks(itertools.chain(first_chunk, variants), chunk_size)
+  if parallel:
+    yield from _count_variant_stats_in_parallel(
+        chunks, vaf_available, vcf_reader, number_of_vaf_bins, cpus
+    )
+  else:
+    for chunk in chunks:
+      yield _count_variant_stats_for_chunk(
+          chunk, vaf_available, vcf_reader, number_of_vaf_bins
+      )
+
+
+def _variant_stats_columns_for_chunk(variants, vaf_available, vcf_reader):
+  """Computes the stats of each variant, stored column by column.
+
+  Args:
+    variants: list(Variant).
+    vaf_available: bool. Whether VAF is defined in the VCF FORMAT fields.
+    vcf_reader: VcfReader.
+
+  Returns:
+    A dict of columns keyed by reference_bases, alternate_bases, variant_type,
+    is_variant, is_transition, is_transversion, depth, genotype_quality,
+    genotype, vaf and qual. Numeric columns are np.ndarrays: variant_type
+    holds codes from _VARIANT_TYPE_CODES, missing depth and genotype_quality
+    values are _MISSING_INT_VALUE, and missing vaf values are NaN. The other
+    columns are lists.
+  """
+  num_variants = len(variants)
+  columns = {
+      'reference_bases': [None] * num_variants,
+      'alternate_bases': [None] * num_variants,
+      'is_variant': np.empty(num_variants, dtype=np.bool_),
+      'depth': np.empty(num_variants, dtype=np.int32),
+      'genotype_quality': np.empty(num_variants, dtype=np.int32),
+      'genotype': [None] * num_variants,
+      'vaf': np.full(num_variants, np.nan, dtype=np.float64),
+      'qual': np.empty(num_variants, dtype=np.float64),
+  }
+  # Per variant predicates used to classify all variants at once below.
+  biallelic = np.empty(num_variants, dtype=np.bool_)
+  snp = np.empty(num_variants, dtype=np.bool_)
+  insertion = np.empty(num_variants, dtype=np.bool_)
+  deletion = np.empty(num_variants, dtype=np.bool_)
+  # ASCII values of the bases of biallelic SNPs, 0 for other variants.
+  ref_bases = np.zeros(num_variants, dtype=np.uint8)
+  alt_bases = np.zeros(num_variants, dtype=np.uint8)
+  for i, variant in enumerate(variants):
+    call = variant_utils.only_call(variant)
+    is_variant = variant_utils.is_variant_call(variant)
+    biallelic[i], snp[i], insertion[i], deletion[i] = _allele_features(variant)
+    if is_variant and biallelic[i] and snp[i]:
+      ref_bases[i] = ord(variant.reference_bases)
+      alt_bases[i] = ord(variant.alternate_bases[0])
+    columns['reference_bases'][i] = variant.reference_bases
+    columns['alternate_bases'][i] = list(variant.alternate_bases)
+    columns['is_variant'][i] = is_variant
+    columns['depth'][i] = _int_or_missing(
+        variantcall_utils.get_format(call, 'DP')
+    )
+    columns['genotype_quality'][i] = _int_or_missing(
+        variantcall_utils.get_gq(call)
+    )
+    columns['genotype'][i] = _genotype_key(variantcall_utils.get_gt(call))
+    if vaf_available:
+      columns['vaf'][i] = _get_vaf(call, vcf_reader)
+    columns['qual'][i] = variant.quality
+
+  columns['variant_type'] = _classify_variants(
+      columns['is_variant'], biallelic, snp, insertion, deletion
+  )
+  columns['is_transition'], columns['is_transversion'] = _tstv_columns(
+      columns['variant_type'], ref_bases, alt_bases
+  )
+  return columns
 
 
 def _format_histogram_for_vega(counts, bins):
@@ -182,66 +485,142 @@ def _fraction_histogram(values, number_of_bins=10):
   return _format_histogram_for_vega(counts, bins)
 
 
-def _vaf_histograms_by_genotype(single_stats, number_of_bins=10):
+def _fraction_bin_indices(values, number_of_bins):
+  """Assigns fractions to evenly spaced bins over [0, 1].
+
+  Bins are assigned exactly as np.histogram(values, bins=number_of_bins,
+  range=(0, 1)) would, but without a search over the bin edges.
+
+  Args:
+    values: np.ndarray of floats.
+    number_of_bins: integer, number of bins.
+
+  Returns:
+    A tuple of a boolean mask of values within [0, 1] (NaN is not) and the bin
+    index of each of those values.
+  """
+  in_range = (values >= 0) & (values <= 1)
+  values = values[in_range]
+  bin_edges = np.linspace(0, 1, number_of_bins + 1)
+  bin_indices = (values * number_of_bins).astype(np.intp)
+  bin_indices[bin_indices == number_of_bins] -= 1
+  # Correct for floating point rounding next to the bin edges.
+  bin_indices[values < bin_edges[bin_indices]] -= 1
+  bin_indices[
+      (values >= bin_edges[bin_indices + 1])
+      & (bin_indices != number_of_bins - 1)
+  ] += 1
+  return in_range, bin_indices
+
+
+def _count_vafs_by_genotype(columns, number_of_bins=10):
+  """Counts allele frequencies in each histogram bin, for each genotype.
+
+  Args:
+    columns: dict of variant stats columns, see
+      _variant_stats_columns_for_chunk.
+    number_of_bins: integer, number of bins in allele frequency histogram.
+
+  Returns:
+    A dictionary keyed by genotype where each value is an np.ndarray of counts
+    per bin.
+  """
+  # Group by genotype, numbering the genotypes in sorted order.
+  genotypes, genotype_ids = np.unique(
+      np.asarray(columns['genotype'], dtype=str), return_inverse=True
+  )
+  # Count vafs where they are defined, for all genotypes in a single bincount.
+  has_vaf, bin_indices = _fraction_bin_indices(columns['vaf'], number_of_bins)
+  counts = np.bincount(
+      genotype_ids[has_vaf] * number_of_bins + bin_indices,
+      minlength=len(genotypes) * number_of_bins,
+  ).reshape(len(genotypes), number_of_bins)
+  return {
+      str(genotype): genotype_counts
+      for genotype, genotype_counts in zip(genotypes, counts)
+  }
+
+
+def _vaf_histograms_by_genotype(vaf_counts_by_genotype, number_of_bins=10):
   """Computes histograms of allele frequency for each genotype.
 
   Args:
-    single_stats: list of VariantStats objects.
+    vaf_counts_by_genotype: dict of counts per bin keyed by genotype, see
+      _count_vafs_by_genotype.
     number_of_bins: integer, number of bins in allele frequency histogram.
 
   Returns:
     A dictionary keyed by genotype where each value is a list of bins.
   """
-
-  # Group by genotype
-  sorted_by_genotype = sorted(single_stats, key=lambda x: x.genotype)
-  grouped_by_genotype = itertools.groupby(
-      sorted_by_genotype, lambda x: x.genotype
-  )
+  bins = np.linspace(0, 1, number_of_bins + 1)
   # Fill in empty placeholders for genotypes to populate all five charts
   stats_by_genotype = {}
   required_genotypes = ['[0, 0]', '[0, 1]', '[1, 1]', '[-1, -1]', '[1, 2]']
   for genotype in required_genotypes:
     # Create a few placeholder bins
     stats_by_genotype[genotype] = _fraction_histogram([], 2)
-  # Count vafs from variants (replacing placeholders)
-  for genotype, group in grouped_by_genotype:
-    # Get VAF for each variant where it is defined
-    vafs = [x.vaf for x in group if x.vaf is not None]
-    stats_by_genotype[genotype] = _fraction_histogram(vafs, number_of_bins)
+  # Replace placeholders with the histograms of genotypes that were seen
+  for genotype in sorted(vaf_counts_by_genotype):
+    stats_by_genotype[genotype] = _format_histogram_for_vega(
+        vaf_counts_by_genotype[genotype], bins
+    )
 
   return stats_by_genotype
 
 
-def _count_base_changes_and_indel_sizes(single_stats):
+def _count_base_changes_and_indel_sizes(columns):
   """Count each base change, such as A->G or C->T, and count the number of indels of each size.
 
   Args:
-    single_stats: list of VariantStats objects.
+    columns: dict of variant stats columns, see
+      _variant_stats_columns_for_chunk.
 
   Returns:
+    base_changes: Counter({(ref, alt): count, ...})
+    indel_sizes: Counter({size: count, ...})
+  """
+  refs = columns['reference_bases']
+  alts = columns['alternate_bases']
+  variant_type = columns['variant_type']
+  # RefCalls are ignored
+  is_variant = columns['is_variant']
+  # Multiallelic variants ignored here because they have different indel
+  # sizes and/or base changes
+  snvs = np.flatnonzero(
+      is_variant & (variant_type == _VARIANT_TYPE_CODES[BIALLELIC_SNP])
+  )
+  indels = np.flatnonzero(
+      is_variant
+      & np.isin(
+          variant_type,
+          [
+              _VARIANT_TYPE_CODES[BIALLELIC_INSERTION],
+              _VARIANT_TYPE_CODES[BIALLELIC_DELETION],
+          ],
+      )
+  )
+  # SNV: get base change
+  base_changes = collections.Counter((refs[i], alts[i][0]) for i in snvs)
+  # indel: get size
+  # + = insertion
+  # - = deletion
+  indel_sizes = collections.Counter(
+      len(alts[i][0]) - len(refs[i]) for i in indels
+  )
+  return base_changes, indel_sizes
+
+
+def _base_changes_and_indel_sizes_for_json(base_changes, indel_sizes):
+  """Formats the counts from _count_base_changes_and_indel_sizes for charts.
+
+  Args:
     base_changes: {(ref, alt): count, ...}
     indel_sizes: {size: count, ...}
-  """
-  base_changes = collections.defaultdict(int)
-  indel_sizes = collections.defaultdict(int)
-  for v in single_stats:
-    ref = v.reference_bases
-    alts = v.alternate_bases
-    # RefCalls are ignored
-    if v.is_variant:
-      # Multiallelic variants ignored here because they have different indel
-      # sizes and/or base changes
-      if v.variant_type == BIALLELIC_SNP:
-        # SNV: get base change
-        base_changes[(ref, alts[0])] += 1
-      elif v.variant_type in [BIALLELIC_INSERTION, BIALLELIC_DELETION]:
-        # indel: get size
-        # + = insertion
-        # - = deletion
-        size = len(alts[0]) - len(ref)
-        indel_sizes[size] += 1
 
+  Returns:
+    base_changes: [[ref, alt, count], ...]
+    indel_sizes: [[size, count], ...]
+  """
   base_changes_for_json = []
   for key in base_changes:
     ref, alt = key
@@ -254,95 +633,154 @@ def _count_base_changes_and_indel_sizes(single_stats):
   return base_changes_for_json, indel_sizes_for_json
 
 
-def _round_down(num):
-  return int(math.floor(num))
+def _count_quals(columns):
+  """Counts variants in unit-width bins of variant quality (QUAL column in VCF).
 
+  Args:
+    columns: dict of variant stats columns, see
+      _variant_stats_columns_for_chunk.
 
-def _round_up(num):
-  return int(math.ceil(num))
+  Returns:
+    A dict mapping the start of each bin that has variants to their count.
+  """
+  quals = np.round(columns['qual'], 4)
+  bin_starts, counts = np.unique(np.floor(quals), return_counts=True)
+  return dict(zip(bin_starts.tolist(), counts.tolist()))
 
 
-def _compute_qual_histogram(single_var_stats):
+def _compute_qual_histogram(qual_counts):
   """Compute a histogram over variant quality (QUAL column in VCF).
 
   Args:
-    single_var_stats: list of VariantStats objects.
+    qual_counts: dict of counts keyed by bin start, see _count_quals.
 
   Returns:
     histogram of variant quality scores.
   """
-  quals = [round(v.qual, 4) for v in single_var_stats]
+  # s = bin_start, e = bin_end, c = count
+  return [
+      {'s': start, 'e': start + 1, 'c': qual_counts[start]}
+      for start in sorted(qual_counts)
+  ]
 
-  if quals:
-    bin_range = (_round_down(min(quals)), _round_up(max(quals) + 1))
-    counts, bins = np.histogram(
-        quals, range=bin_range, bins=bin_range[1] - bin_range[0]
-    )
-    hist = _format_histogram_for_vega(counts, bins)
-    return [x for x in hist if x['c'] > 0]
-  else:
-    return []
 
+def _count_integers(nums):
+  """Counts the occurrences of each integer.
 
-def _get_integer_counts(nums):
-  """Turn a list of integers into a list of counts of those integers.
+  Args:
+    nums: an np.ndarray of integers (e.g. [1,2,2,4])
+
+  Returns:
+    a dict mapping each integer to its count (e.g. {1: 1, 2: 2, 4: 1})
+  """
+  values, counts = np.unique(nums, return_counts=True)
+  return dict(zip(values.tolist(), counts.tolist()))
+
+
+def _get_integer_counts(counts):
+  """Turn counts of integers into a sorted list of [num, count] pairs.
 
   Args:
-    nums: a list of numbers (e.g. [1,2,2,4])
+    counts: a dict mapping integers to counts (e.g. {4: 1, 1: 1, 2: 2})
 
   Returns:
     a list of [num, count] (e.g. [[1,1],[2,2],[4,1]]) for all integers with
     non-zero counts
   """
-  bin_counts = np.bincount(nums)
-  non_zero_counts = [[i, x] for i, x in enumerate(bin_counts) if x > 0]
-  return non_zero_counts
+  return [[num, counts[num]] for num in sorted(counts) if counts[num] > 0]
 
 
-def _compute_gq_histogram(single_var_stats):
-  """Compute a histogram over genotype quality (GQ sub-column under FORMAT in VCF).
+def _count_genotype_qualities(columns):
+  """Counts genotype qualities (GQ sub-column under FORMAT in VCF).
 
   Args:
-    single_var_stats: list of VariantStats objects.
+    columns: dict of variant stats columns, see
+      _variant_stats_columns_for_chunk.
 
   Returns:
-    histogram of genotype quality scores.
+    a dict mapping each genotype quality to its count.
   """
-  quals = [
-      v.genotype_quality
-      for v in single_var_stats
-      if not isinstance(v.genotype_quality, list)
-  ]
-  return _get_integer_counts(quals)
+  quals = columns['genotype_quality']
+  return _count_integers(quals[quals != _MISSING_INT_VALUE])
 
 
-def _compute_depth_histogram(single_var_stats):
-  """Compute a histogram on the depth, with larger bins as depth increases."""
-  depths = [v.depth for v in single_var_stats if not isinstance(v.depth, list)]
-  return _get_integer_counts(depths)
+def _count_depths(columns):
+  """Counts depths (DP sub-column under FORMAT in VCF)."""
+  depths = columns['depth']
+  return _count_integers(depths[depths != _MISSING_INT_VALUE])
 
 
-def _count_variant_types(single_stats):
-  count_all_variant_types = collections.defaultdict(int)
-  for v in single_stats:
-    count_all_variant_types[v.variant_type] += 1
+def _count_variant_types(columns):
+  """Counts the variants of each type, omitting types with no variants."""
+  counts = np.bincount(columns['variant_type'], minlength=len(_VARIANT_TYPES))
+  return {
+      vtype: int(counts[code])
+      for code, vtype in enumerate(_VARIANT_TYPES)
+      if counts[code] > 0
+  }
 
-  return count_all_variant_types
 
+def _count_titv(columns):
+  """Counts the biallelic SNPs that are transitions and transversions."""
+  return {
+      'Transition': int(np.sum(columns['is_transition'])),
+      'Transversion': int(np.sum(columns['is_transversion'])),
+  }
+
+
+# Counts of the stats of a chunk of variants that the charts are built from.
+# Every field is a collections.Counter, so the counts of many chunks add up
+# with Counter.update. The values of vaf_counts_by_genotype are np.ndarrays of
+# counts per bin, which add up elementwise.
+_VariantStatsCounts = collections.namedtuple(
+    '_VariantStatsCounts',
+    [
+        'variant_type_counts',
+        'titv_counts',
+        'base_changes',
+        'indel_sizes',
+        'vaf_counts_by_genotype',
+        'qual_counts',
+        'gq_counts',
+        'depth_counts',
+    ],
+)
+
+
+def _count_variant_stats(columns, number_of_vaf_bins):
+  """Counts the stats of a chunk of variants.
+
+  Args:
+    columns: dict of variant stats columns, see
+      _variant_stats_columns_for_chunk.
+    number_of_vaf_bins: integer, number of bins in allele frequency histogram.
 
-def _count_titv(single_stats):
-  titv_counts = {'Transition': 0, 'Transversion': 0}
-  titv_counts['Transition'] = sum([v.is_transition for v in single_stats])
-  titv_counts['Transversion'] = sum([v.is_transversion for v in single_stats])
-  return titv_counts
+  Returns:
+    A _VariantStatsCounts.
+  """
+  base_changes, indel_sizes = _count_base_changes_and_indel_sizes(columns)
+  return _VariantStatsCounts(
+      variant_type_counts=collections.Counter(_count_variant_types(columns)),
+      titv_counts=collections.Counter(_count_titv(columns)),
+      base_changes=base_changes,
+      indel_sizes=indel_sizes,
+      vaf_counts_by_genotype=collections.Counter(
+          _count_vafs_by_genotype(columns, number_of_bins=number_of_vaf_bins)
+      ),
+      qual_counts=collections.Counter(_count_quals(columns)),
+      gq_counts=collections.Counter(_count_genotype_qualities(columns)),
+      depth_counts=collections.Counter(_count_depths(columns)),
+  )
 
 
-def _compute_variant_stats_for_charts(variants, vcf_reader=None):
+def _compute_variant_stats_for_charts(variants, vcf_reader=None, cpus=0):
   """Computes variant statistics of each variant.
 
   Args:
     variants: iterable(Variant).
     vcf_reader: VcfReader.
+    cpus: int. Number of worker processes to use, see
+      _count_variant_stats_by_chunk.
 
   Returns:
     A dict with summarized data prepared for charts.
@@ -352,22 +790,32 @@ def _compute_variant_stats_for_charts(variants, vcf_reader=None):
     vcf_columns = [col.id for col in vcf_reader.header.formats]
     vaf_available = 'VAF' in vcf_columns
 
-  single_var_stats = _single_variant_stats(
-      variants, vaf_available=vaf_available, vcf_reader=vcf_reader
+  number_of_vaf_bins = 50
+  # Only these running counts are kept, each chunk of variants is discarded
+  # as soon as it has been counted.
+  counts = _VariantStatsCounts(
+      *(collections.Counter() for _ in _VariantStatsCounts._fields)
   )
-
-  titv_counts = _count_titv(single_var_stats)
-  variant_type_counts = _count_variant_types(single_var_stats)
-
-  base_changes, indel_sizes = _count_base_changes_and_indel_sizes(
-      single_var_stats
+  counts.titv_counts.update({'Transition': 0, 'Transversion': 0})
+  for chunk_counts in _count_variant_stats_by_chunk(
+      variants,
+      number_of_vaf_bins,
+      vaf_available=vaf_available,
+      vcf_reader=vcf_reader,
+      cpus=cpus,
+  ):
+    for total, chunk_total in zip(counts, chunk_counts):
+      total.update(chunk_total)
+
+  base_changes, indel_sizes = _base_changes_and_indel_sizes_for_json(
+      counts.base_changes, counts.indel_sizes
   )
-
-  histograms = _vaf_histograms_by_genotype(single_var_stats, number_of_bins=50)
-
-  qual_histogram = _compute_qual_histogram(single_var_stats)
-  gq_hist = _compute_gq_histogram(single_var_stats)
-  depth_histogram = _compute_depth_histogram(single_var_stats)
+  histograms = _vaf_histograms_by_genotype(
+      counts.vaf_counts_by_genotype, number_of_bins=number_of_vaf_bins
+  )
+  qual_histogram = _compute_qual_histogram(counts.qual_counts)
+  gq_hist = _get_integer_counts(counts.gq_counts)
+  depth_histogram = _get_integer_counts(counts.depth_counts)
 
   vis_data = {
       'vaf_histograms_by_genotype': histograms,
@@ -375,18 +823,20 @@ def _compute_variant_stats_for_charts(variants, vcf_reader=None):
       'base_changes': base_changes,
       'qual_histogram': qual_histogram,
       'gq_histogram': gq_hist,
-      'variant_type_counts': variant_type_counts,
+      'variant_type_counts': dict(counts.variant_type_counts),
       'depth_histogram': depth_histogram,
-      'titv_counts': titv_counts,
+      'titv_counts': dict(counts.titv_counts),
   }
 
   return vis_data
 
 
-def create_vcf_report(variants, output_basename, title=None, vcf_reader=None):
+def create_vcf_report(
+    variants, output_basename, title=None, vcf_reader=None, cpus=0
+):
   """Calculate VCF stats and create a visual report."""
   vis_data = _compute_variant_stats_for_charts(
-      variants=variants, vcf_reader=vcf_reader
+      variants=variants, vcf_reader=vcf_reader, cpus=cpus
   )
 
   vcf_stats_vis.create_visual_report(
@@ -29,6 +29,7 @@
 r"""Creates a visual HTML report about the variants from a VCF file."""
 
 import itertools
+
 from absl import flags
 import tensorflow as tf
 
@@ -60,6 +61,13 @@ _NUM_RECORDS = flags.DEFINE_integer(
     -1,
     'Maximum number of VCF lines to read. If negative, read the whole VCF.',
 )
+_CPUS = flags.DEFINE_integer(
+    'cpus',
+    0,
+    'Number of worker processes to use. Use 0 to disable parallel processing. '
+    'Small VCFs are always processed without worker processes.',
+    short_name='j',
+)
 
 
 def main(argv):
@@ -95,6 +103,7 @@ def main(argv):
         output_basename=_OUTFILE_BASE.value,
         title=_TITLE.value or sample_name,
         vcf_reader=reader,
+        cpus=_CPUS.value,
     )
 
 
@@ -28,13 +28,15 @@
 # POSSIBILITY OF SUCH DAMAGE.
 r"""Tests for deepvariant .vcf_stats."""
 
-import collections
+import itertools
 import json
 import os
 import tempfile
+from unittest import mock
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import numpy as np
 import tensorflow as tf
 
 from deepvariant import testdata
@@ -149,6 +151,29 @@ class VcfStatsTest(parameterized.TestCase):
   def test_get_variant_type(self, variant, expected_type):
     self.assertEqual(vcf_stats._get_variant_type(variant), expected_type)
 
+  @parameterized.parameters(
+      ([0, 1],),
+      ([1, 0],),
+      ([-1, -1],),
+      ([2, 1],),
+      ([12, 3],),
+      ([1],),
+      ([2, 0, 1],),
+      ([],),
+  )
+  def test_genotype_key(self, gt):
+    self.assertEqual(vcf_stats._genotype_key(gt), str(sorted(gt)))
+
+  def test_is_transition(self):
+    bases = 'ACGTN'
+    pairs = [(ref, alt) for ref in bases for alt in bases if ref != alt]
+    ref_bases = np.array([ord(ref) for ref, _ in pairs], dtype=np.uint8)
+    alt_bases = np.array([ord(alt) for _, alt in pairs], dtype=np.uint8)
+    self.assertEqual(
+        vcf_stats._is_transition(ref_bases, alt_bases).tolist(),
+        [variant_utils.is_transition(ref, alt) for ref, alt in pairs],
+    )
+
   @parameterized.parameters(
       dict(
           alleles=['A', 'G'],
@@ -223,7 +248,7 @@ class VcfStatsTest(parameterized.TestCase):
           expected_is_variant=False,
       ),
   )
-  def test_get_variant_stats(
+  def test_variant_stats_columns_for_chunk_single_variant(
       self,
       alleles,
       gt,
@@ -235,24 +260,151 @@ class VcfStatsTest(parameterized.TestCase):
     variant = test_utils.make_variant(
         chrom='chr1', start=10, alleles=alleles, gt=gt, gq=59
     )
-    variant_stats = vcf_stats._get_variant_stats(variant)
+    columns = vcf_stats._variant_stats_columns_for_chunk(
+        [variant], vaf_available=False, vcf_reader=None
+    )
+    self.assertEqual(columns['reference_bases'], [alleles[0]])
+    self.assertEqual(columns['alternate_bases'], [alleles[1:]])
+    self.assertEqual(
+        vcf_stats._VARIANT_TYPES[columns['variant_type'][0]],
+        expected_variant_type,
+    )
+    self.assertEqual(columns['is_transition'].tolist(), [expected_transition])
+    self.assertEqual(
+        columns['is_transversion'].tolist(), [expected_transversion]
+    )
+    self.assertEqual(columns['is_variant'].tolist(), [expected_is_variant])
+    self.assertEqual(columns['depth'].tolist(), [vcf_stats._MISSING_INT_VALUE])
+    self.assertEqual(columns['genotype_quality'].tolist(), [59])
+    self.assertEqual(columns['genotype'], [str(gt)])
+    self.assertTrue(np.isnan(columns['vaf'][0]))
+    self.assertEqual(columns['qual'].tolist(), [0.0])
+
+  def test_variant_stats_columns_for_chunk(self):
+    refcall = test_utils.make_variant(
+        chrom='chr2', start=99, alleles=['AT', 'A'], gt=[0, 0]
+    )
+    columns = vcf_stats._variant_stats_columns_for_chunk(
+        [self.variant, refcall], vaf_available=False, vcf_reader=None
+    )
+    self.assertEqual(columns['reference_bases'], ['A', 'AT'])
+    self.assertEqual(columns['alternate_bases'], [['G'], ['A']])
+    self.assertEqual(
+        [vcf_stats._VARIANT_TYPES[c] for c in columns['variant_type']],
+        [vcf_stats.BIALLELIC_SNP, vcf_stats.REFCALL],
+    )
+    self.assertEqual(columns['is_variant'].tolist(), [True, False])
+    self.assertEqual(columns['is_transition'].tolist(), [True, False])
+    self.assertEqual(columns['is_transversion'].tolist(), [False, False])
+    self.assertEqual(columns['depth'].tolist(), [20, -1])
+    self.assertEqual(columns['genotype_quality'].tolist(), [59, -1])
+    self.assertEqual(columns['genotype'], ['[0, 1]', '[0, 0]'])
+    self.assertTrue(all(np.isnan(columns['vaf'])))
+    self.assertEqual(columns['qual'].tolist(), [0.0, 0.0])
+
+  def test_variant_stats_columns_for_chunk_variant_types(self):
+    variants = [
+        test_utils.make_variant(alleles=alleles, gt=gt, filters=filters)
+        for alleles, gt, filters in [
+            (['A', 'G'], [0, 1], None),
+            (['A', 'C'], [1, 1], None),
+            (['A', 'C', '<*>'], [0, 1], None),
+            (['A', 'AG'], [0, 1], None),
+            (['AG', 'A', '<*>'], [0, 1], None),
+            (['AG', 'TC'], [0, 1], None),
+            (['A', 'C', 'G'], [1, 2], None),
+            (['A', 'AC', 'AG'], [1, 2], None),
+            (['AGC', 'AC', 'A'], [1, 2], None),
+            (['A', 'G', 'AT'], [1, 2], None),
+            (['A', 'G'], [0, 0], None),
+            (['A', 'G'], [0, 1], 'FAIL'),
+            (['A', '<*>'], [0, 0], None),
+        ]
+    ]
+    columns = vcf_stats._variant_stats_columns_for_chunk(
+        variants, vaf_available=False, vcf_reader=None
+    )
+    self.assertEqual(
+        [vcf_stats._VARIANT_TYPES[c] for c in columns['variant_type']],
+        [vcf_stats._get_variant_type(v) for v in variants],
+    )
+    self.assertEqual(
+        columns['is_transition'].tolist(),
+        [True] + [False] * (len(variants) - 1),
+    )
+    self.assertEqual(
+        columns['is_transversion'].tolist(),
+        [False, True, True] + [False] * (len(variants) - 3),
+    )
+
+  def test_variant_type_table(self):
+    for features in itertools.product([False, True], repeat=4):
+      key = vcf_stats._variant_type_key(*features)
+      self.assertEqual(
+          vcf_stats._VARIANT_TYPES[vcf_stats._VARIANT_TYPE_TABLE[key]],
+          vcf_stats._variant_type_from_features(*features),
+      )
+
+  @parameterized.parameters(
+      dict(cpus=0, expected_chunk_sizes=[4, 4, 1]),
+      # In parallel, chunks are split cpus + 1 ways to bound the variants in
+      # flight.
+      dict(cpus=3, expected_chunk_sizes=[1] * 9),
+  )
+  def test_count_variant_stats_by_chunk(self, cpus, expected_chunk_sizes):
+    variants = [
+        test_utils.make_variant(start=i, alleles=['A', 'G'], gt=[0, 1])
+        for i in range(9)
+    ]
+    with mock.patch.object(vcf_stats, '_VARIANTS_PER_CHUNK', 4):
+      chunk_counts = list(
+          vcf_stats._count_variant_stats_by_chunk(
+              iter(variants), number_of_vaf_bins=10, cpus=cpus
+          )
+      )
+    self.assertEqual(
+        [counts.titv_counts for counts in chunk_counts],
+        [
+            {'Transition': size, 'Transversion': 0}
+            for size in expected_chunk_sizes
+        ],
+    )
+
+  def test_count_variant_stats_by_chunk_empty(self):
     self.assertEqual(
-        variant_stats,
-        vcf_stats.VariantStats(
-            reference_name='chr1',
-            position=11,
-            reference_bases=alleles[0],
-            alternate_bases=alleles[1:],
-            variant_type=expected_variant_type,
-            is_transition=expected_transition,
-            is_transversion=expected_transversion,
-            is_variant=expected_is_variant,
-            depth=[],
-            genotype_quality=59,
-            genotype=str(gt),
-            vaf=None,
-            qual=0.0,
+        list(
+            vcf_stats._count_variant_stats_by_chunk(
+                iter([]), number_of_vaf_bins=10
+            )
         ),
+        [],
+    )
+
+  def test_compute_variant_stats_for_charts_in_chunks(self):
+    variants = []
+    for i, (alleles, gt, gq) in enumerate([
+        (['A', 'G'], [0, 1], 30),
+        (['A', 'C'], [1, 1], 40),
+        (['A', 'AG'], [0, 1], 30),
+        (['AG', 'A'], [1, 1], 50),
+        (['A', 'G'], [0, 0], 10),
+        (['A', 'C', 'G'], [1, 2], 30),
+        (['C', 'T'], [0, 1], 40),
+    ]):
+      variant = test_utils.make_variant(
+          start=i, alleles=alleles, gt=gt, gq=gq
+      )
+      variant.quality = 10.5 * i
+      variantcall_utils.set_format(
+          variant_utils.only_call(variant), 'DP', 10 + i % 3
+      )
+      variants.append(variant)
+    expected = vcf_stats._compute_variant_stats_for_charts(variants)
+    with mock.patch.object(vcf_stats, '_VARIANTS_PER_CHUNK', 2):
+      vis_data = vcf_stats._compute_variant_stats_for_charts(iter(variants))
+    self.assertEqual(
+        json.dumps(vis_data, sort_keys=True, default=int),
+        json.dumps(expected, sort_keys=True, default=int),
     )
 
   def test_compute_variant_stats_for_charts(self):
@@ -274,19 +426,19 @@ class VcfStatsTest(parameterized.TestCase):
     )
 
   def test_vaf_histograms_by_genotype(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite', ['genotype', 'vaf']
-    )
-    variant_stats = [
-        variant_stats_lite(genotype='[0, 0]', vaf=0),
-        variant_stats_lite(genotype='[1, 1]', vaf=1),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.5),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.5),
-        variant_stats_lite(genotype='[0, 0]', vaf=0.08),
-        variant_stats_lite(genotype='[0, 0]', vaf=0.19),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.45),
-        variant_stats_lite(genotype='[0, 1]', vaf=0.65),
-    ]
+    columns = {
+        'genotype': [
+            '[0, 0]',
+            '[1, 1]',
+            '[0, 1]',
+            '[0, 1]',
+            '[0, 0]',
+            '[0, 0]',
+            '[0, 1]',
+            '[0, 1]',
+        ],
+        'vaf': np.array([0, 1, 0.5, 0.5, 0.08, 0.19, 0.45, 0.65]),
+    }
     # s = bin_start, e = bin_end, c = count
     truth_histograms = """
     {
@@ -298,10 +450,31 @@ class VcfStatsTest(parameterized.TestCase):
       }
     """
     self.assertEqual(
-        vcf_stats._vaf_histograms_by_genotype(variant_stats),
+        vcf_stats._vaf_histograms_by_genotype(
+            vcf_stats._count_vafs_by_genotype(columns)
+        ),
         json.loads(truth_histograms),
     )
 
+  @parameterized.parameters(2, 10, 50)
+  def test_fraction_bin_indices_matches_np_histogram(self, number_of_bins):
+    values = np.concatenate([
+        np.linspace(0, 1, 101),
+        np.linspace(0, 1, number_of_bins + 1),
+        [np.nan, -0.1, 1.1],
+    ])
+    in_range, bin_indices = vcf_stats._fraction_bin_indices(
+        values, number_of_bins
+    )
+    expected_counts, _ = np.histogram(
+        values[~np.isnan(values)], bins=number_of_bins, range=(0, 1)
+    )
+    self.assertEqual(np.sum(in_range), np.sum(expected_counts))
+    self.assertEqual(
+        np.bincount(bin_indices, minlength=number_of_bins).tolist(),
+        expected_counts.tolist(),
+    )
+
   def test_format_histogram_for_vega(self):
     # s = bin_start, e = bin_end, c = count
     self.assertEqual(
@@ -310,110 +483,113 @@ class VcfStatsTest(parameterized.TestCase):
     )
 
   def test_count_titv(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite', ['is_transition', 'is_transversion']
-    )
-    variant_stats = [
-        variant_stats_lite(is_transition=True, is_transversion=False),
-        variant_stats_lite(is_transition=True, is_transversion=False),
-        variant_stats_lite(is_transition=True, is_transversion=False),
-        variant_stats_lite(is_transition=False, is_transversion=True),
-        variant_stats_lite(is_transition=False, is_transversion=True),
-        variant_stats_lite(is_transition=False, is_transversion=False),
-    ]
+    columns = {
+        'is_transition': np.array([True, True, True, False, False, False]),
+        'is_transversion': np.array([False, False, False, True, True, False]),
+    }
     truth_counts = {'Transition': 3, 'Transversion': 2}
-    self.assertEqual(vcf_stats._count_titv(variant_stats), truth_counts)
+    self.assertEqual(vcf_stats._count_titv(columns), truth_counts)
 
   def test_count_variant_types(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite', ['variant_type']
-    )
-    variant_stats = [
-        variant_stats_lite(variant_type='A'),
-        variant_stats_lite(variant_type='B'),
-        variant_stats_lite(variant_type='C'),
-        variant_stats_lite(variant_type='A'),
-        variant_stats_lite(variant_type='B'),
+    variant_types = [
+        vcf_stats.BIALLELIC_SNP,
+        vcf_stats.REFCALL,
+        vcf_stats.BIALLELIC_DELETION,
+        vcf_stats.BIALLELIC_SNP,
+        vcf_stats.REFCALL,
     ]
-    truth_counts = {'A': 2, 'B': 2, 'C': 1}
+    columns = {
+        'variant_type': np.array(
+            [vcf_stats._VARIANT_TYPE_CODES[t] for t in variant_types],
+            dtype=np.uint8,
+        )
+    }
+    truth_counts = {
+        vcf_stats.BIALLELIC_SNP: 2,
+        vcf_stats.REFCALL: 2,
+        vcf_stats.BIALLELIC_DELETION: 1,
+    }
     self.assertEqual(
-        vcf_stats._count_variant_types(variant_stats), truth_counts
+        vcf_stats._count_variant_types(columns), truth_counts
     )
 
   def test_count_base_changes_and_indel_sizes(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite',
-        ['reference_bases', 'alternate_bases', 'is_variant', 'variant_type'],
-    )
-    variant_stats = [
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['G'],
-            is_variant=True,
-            variant_type=vcf_stats.BIALLELIC_SNP,
-        ),
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['AGGG'],
-            is_variant=True,
-            variant_type=vcf_stats.BIALLELIC_INSERTION,
-        ),
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['G'],
-            is_variant=False,
-            variant_type=vcf_stats.REFCALL,
-        ),
-        variant_stats_lite(
-            reference_bases='A',
-            alternate_bases=['G', 'T'],
-            is_variant=True,
-            variant_type=vcf_stats.MULTIALLELIC_COMPLEX,
-        ),
+    variant_types = [
+        vcf_stats.BIALLELIC_SNP,
+        vcf_stats.BIALLELIC_INSERTION,
+        vcf_stats.REFCALL,
+        vcf_stats.MULTIALLELIC_COMPLEX,
     ]
+    columns = {
+        'reference_bases': ['A', 'A', 'A', 'A'],
+        'alternate_bases': [['G'], ['AGGG'], ['G'], ['G', 'T']],
+        'is_variant': np.array([True, True, False, True]),
+        'variant_type': np.array(
+            [vcf_stats._VARIANT_TYPE_CODES[t] for t in variant_types],
+            dtype=np.uint8,
+        ),
+    }
     truth_base_changes = [['A', 'G', 1]]
     truth_indel_sizes = [[3, 1]]
-    base_changes, indel_sizes = vcf_stats._count_base_changes_and_indel_sizes(
-        variant_stats
+    base_changes, indel_sizes = (
+        vcf_stats._base_changes_and_indel_sizes_for_json(
+            *vcf_stats._count_base_changes_and_indel_sizes(columns)
+        )
     )
     self.assertEqual(base_changes, truth_base_changes)
     self.assertEqual(indel_sizes, truth_indel_sizes)
 
   def test_compute_qual_histogram(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite', ['qual'])
-    variant_stats = [variant_stats_lite(qual=100), variant_stats_lite(qual=49)]
-    hist = vcf_stats._compute_qual_histogram(variant_stats)
+    columns = {'qual': np.array([100.0, 49.0, 49.5])}
+    hist = vcf_stats._compute_qual_histogram(vcf_stats._count_quals(columns))
     # s = bin_start, e = bin_end, c = count
     self.assertEqual(
-        hist, [{'c': 1, 's': 49.0, 'e': 50.0}, {'c': 1, 's': 100.0, 'e': 101.0}]
+        hist, [{'c': 2, 's': 49.0, 'e': 50.0}, {'c': 1, 's': 100.0, 'e': 101.0}]
+    )
+
+  def test_count_integers(self):
+    self.assertEqual(
+        vcf_stats._count_integers(np.array([1, 2, 2, 4])), {1: 1, 2: 2, 4: 1}
     )
 
   def test_get_integer_counts(self):
     self.assertEqual(
-        vcf_stats._get_integer_counts([1, 2, 2, 4]), [[1, 1], [2, 2], [4, 1]]
+        vcf_stats._get_integer_counts({4: 1, 1: 1, 2: 2}),
+        [[1, 1], [2, 2], [4, 1]],
     )
 
-  def test_compute_gq_histogram(self):
-    variant_stats_lite = collections.namedtuple(
-        'variant_stats_lite', ['genotype_quality']
+  def test_count_genotype_qualities(self):
+    columns = {'genotype_quality': np.array([100, 100, 49, -1], dtype=np.int32)}
+    counts = vcf_stats._count_genotype_qualities(columns)
+    self.assertEqual(counts, {49: 1, 100: 2})
+
+  def test_count_depths(self):
+    columns = {'depth': np.array([100, 30, 30, -1], dtype=np.int32)}
+    counts = vcf_stats._count_depths(columns)
+    self.assertEqual(counts, {30: 2, 100: 1})
+
+  def test_compute_variant_stats_for_charts_in_parallel_with_vaf(self):
+    with vcf.VcfReader(testdata.GOLDEN_POSTPROCESS_OUTPUT) as reader:
+      expected = vcf_stats._compute_variant_stats_for_charts(
+          reader.iterate(), vcf_reader=reader, cpus=0
+      )
+    with vcf.VcfReader(testdata.GOLDEN_POSTPROCESS_OUTPUT) as reader:
+      with mock.patch.object(vcf_stats, '_VARIANTS_PER_CHUNK', 10):
+        vis_data = vcf_stats._compute_variant_stats_for_charts(
+            reader.iterate(), vcf_reader=reader, cpus=2
+        )
+    # The workers read VAF through the header they are sent.
+    self.assertTrue(
+        any(
+            bin_counts['c']
+            for histogram in expected['vaf_histograms_by_genotype'].values()
+            for bin_counts in histogram
+        )
+    )
+    self.assertEqual(
+        json.dumps(vis_data, sort_keys=True, default=int),
+        json.dumps(expected, sort_keys=True, default=int),
     )
-    variant_stats = [
-        variant_stats_lite(genotype_quality=100),
-        variant_stats_lite(genotype_quality=100),
-        variant_stats_lite(genotype_quality=49),
-    ]
-    hist = vcf_stats._compute_gq_histogram(variant_stats)
-    self.assertEqual(hist, [[49, 1], [100, 2]])
-
-  def test_compute_depth_histogram(self):
-    variant_stats_lite = collections.namedtuple('variant_stats_lite', ['depth'])
-    variant_stats = [
-        variant_stats_lite(depth=100),
-        variant_stats_lite(depth=30),
-        variant_stats_lite(depth=30),
-    ]
-    hist = vcf_stats._compute_depth_histogram(variant_stats)
-    self.assertEqual(hist, [[30, 2], [100, 1]])
 
   def test_create_vcf_report(self):
     base_dir = tempfile.mkdtemp()